@@ -29,6 +29,7 @@ from . import schema as mschema
 from . import validate
 
 from .history import HistoryList
+from .util import convert_flat_value
 
 
 class DataModel(properties.ObjectNode, ndmodel.NDModel):
@@ -964,17 +965,12 @@ class DataModel(properties.ObjectNode, ndmodel.NDModel):
             { "meta.observation.date": "2012-04-22T03:22:05.432" }
 
         """
-        def convert_val(val):
-            if isinstance(val, datetime.datetime):
-                return val.isoformat()
-            elif isinstance(val, Time):
-                return str(val)
-            return val
-
         if include_arrays:
-            return dict((key, convert_val(val)) for (key, val) in self.iteritems())
+            return dict((key, convert_flat_value(val))
+                        for (key, val) in self.iteritems())
         else:
-            return dict((key, convert_val(val)) for (key, val) in self.iteritems()
+            return dict((key, convert_flat_value(val))
+                        for (key, val) in self.iteritems()
                         if not isinstance(val, np.ndarray))
 
     @property
@@ -2,12 +2,14 @@
 Various utility functions and data types
 """
 
+import datetime
 import sys
 import warnings
 from os.path import basename
 
 import numpy as np
 from astropy.io import fits
+from astropy.time import Time
 
 import logging
 log = logging.getLogger(__name__)
@@ -383,6 +385,37 @@ def get_short_doc(schema):
     return description.partition('\n')[0]
 
 
+def convert_flat_value(val):
+    """
+    Convert a model value to its representation in a flat dictionary.
+
+    `datetime.datetime` values become ISO format strings and
+    `astropy.time.Time` values strings, other values are unchanged.
+    """
+    if isinstance(val, datetime.datetime):
+        return val.isoformat()
+    elif isinstance(val, Time):
+        return str(val)
+    return val
+
+
+def get_instance_value(model, key):
+    """
+    Get a metadata value using a dotted name without inserting defaults.
+
+    Unlike ``model[key]``, nodes missing from the model are not created
+    from their schema defaults.
+
+    Returns None if `key` is not set in `model`.
+    """
+    instance = model._instance
+    for part in key.split('.'):
+        if not isinstance(instance, dict):
+            return None
+        instance = instance.get(part)
+    return instance
+
+
 def ensure_ascii(s):
     if isinstance(s, bytes):
         s = s.decode('ascii')
@@ -417,7 +450,6 @@ def create_history_entry(description, software=None):
 
     """
     from asdf.tags.core import Software, HistoryEntry
-    import datetime
 
     if isinstance(software, list):
             software = [Software(x) for x in software]
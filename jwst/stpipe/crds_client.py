@@ -32,6 +32,10 @@ JWST CAL code and STPIPE, tailoring it to work with DATAMODELS as inputs
 and provide results in the forms required by STPIPE.
 """
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import os
 import re
 
 # ----------------------------------------------------------------------
@@ -46,13 +50,12 @@ from crds.core import crds_cache_locking
 
 # ----------------------------------------------------------------------
 
-# This is really a testing and debug convenience function,  and notably now
-# the only place in this module that a direct import of datamodels occurs
-# or datamodels open() occurs.
+# Backs get_reference_files() for filename datasets,  and remains a handy
+# testing and debug entry point.
 def get_refpaths_from_filename(filename, reference_file_types, observatory=None):
-    """Test wrapper to open/close data model for get_multiple_reference_paths.
+    """Open/close the data model in `filename` once for get_multiple_reference_paths().
 
-    See also get_multiple_reference_filepaths().
+    See also get_reference_files().
     """
     from .. import datamodels
     with datamodels.open(filename) as model:
@@ -63,13 +66,19 @@ def get_refpaths_from_filename(filename, reference_file_types, observatory=None)
     
 # import memory_profiler
 # @memory_profiler.profile
-def get_multiple_reference_paths(dataset_model, reference_file_types, observatory=None):
+def get_multiple_reference_paths(dataset_model, reference_file_types, observatory=None,
+                                 overrides=None):
     """Aligns JWST pipeline requirements with CRDS library top level interfaces.
     
     `dataset_model` is an open data model.
 
     `reference_file_types` is a list of reference file type name strings.
 
+    If `overrides` is not None,  it should be a dict { filetype : filepath, ... }
+    of reference files to use instead of CRDS best references.  Overridden
+    types are not looked up in CRDS,  and `dataset_model` is not consulted
+    at all when every type is overridden.
+
     If `observatory` is not None,  it should be a string naming the 
     telescope and valid for CRDS, e.g. 'jwst' or 'hst'.
 
@@ -80,45 +89,190 @@ def get_multiple_reference_paths(dataset_model, reference_file_types, observator
 
     Returns best references dict { filetype : filepath or "N/A", ... }
     """
-    data_dict = _get_data_dict(dataset_model)
+    overrides = overrides or {}
+    refpaths = {filetype: overrides[filetype]
+                for filetype in reference_file_types if filetype in overrides}
+    fetch_types = tuple(filetype for filetype in reference_file_types
+                        if filetype not in overrides)
+    if fetch_types:
+        observatory, data_dict = _get_crds_parameters(dataset_model, observatory)
+        refpaths.update(_get_refpaths(data_dict, fetch_types, observatory))
+    return refpaths
+
+# ......................
+
+def _get_crds_parameters(dataset_model, observatory):
+    """Return (observatory, data_dict) for CRDS lookups on `dataset_model`.
+
+    `observatory` is lower cased,  defaulting to the telescope of
+    `dataset_model` and then to 'jwst'.   `data_dict` holds the parameters
+    the current context matches on,  see _crds_parkeys_for().
+    """
     if observatory is None:
         observatory = dataset_model.meta.telescope or 'jwst'
     observatory = observatory.lower()
-    refpaths = _get_refpaths(data_dict, tuple(reference_file_types), observatory)
-    return refpaths
+    parkeys = _crds_parkeys_for(get_context_used(observatory))
+    return observatory, _get_data_dict(dataset_model, parkeys)
 
-# ......................
-    
-def _get_data_dict(dataset_model):
+def _get_data_dict(dataset_model, parkeys=None):
     """Return the data models header dictionary based on open data 
     `dataset_model`.
+
+    If `parkeys` is not None,  only those dotted keywords are read from
+    `dataset_model` rather than flattening the entire model.
+
     Returns a flat parameter dictionary used for CRDS bestrefs matching.
     """
-    header = dataset_model.to_flat_dict(include_arrays=False)
+    if parkeys is None:
+        header = dataset_model.to_flat_dict(include_arrays=False)
+    else:
+        from ..datamodels.util import convert_flat_value, get_instance_value
+        header = {}
+        for key in parkeys:
+            val = get_instance_value(dataset_model, key)
+            if val is not None:
+                header[key] = convert_flat_value(val)
     return _clean_flat_dict(header)
 
+# Parameter names successfully determined per context.
+_CRDS_PARKEYS = {}
+
+def _crds_parkeys_for(context):
+    """Return the lower case dataset keywords CRDS `context` matches on to
+    select any reference type for any instrument.
+
+    The same keywords are used for every reference type so that best
+    references cached for one lookup serve later lookups of other types.
+
+    Returns None if the context's mappings are not in the CRDS cache yet,  in
+    which case the whole dataset header should be used.   Failures are not
+    remembered so the parameters are used once bestrefs has synced the context.
+    """
+    if context in _CRDS_PARKEYS:
+        return _CRDS_PARKEYS[context]
+    try:
+        pmap = crds.get_pickled_mapping(context)
+    except (exceptions.CrdsError, OSError):
+        return None
+    parkeys = {parkey.lower()
+               for instrument_parkeys in pmap.get_required_parkeys().values()
+               for parkey in instrument_parkeys}
+    _CRDS_PARKEYS[context] = parkeys = tuple(sorted(parkeys))
+    return parkeys
+
+# Header value types passed through to CRDS bestrefs matching.
+_SCALAR_TYPES = (str, int, float, complex, bool)
+
 def _clean_flat_dict(header):
     """Make sure all header items returned are simple, no complex objects."""
     return { key: val for (key,val) in header.items()
-             if isinstance(val, (str,int,float,complex,bool)) }
+             if isinstance(val, _SCALAR_TYPES) }
 
 # ......................
 
 def _get_refpaths(data_dict, reference_file_types, observatory):
     """Tailor the CRDS core library getreferences() call to the JWST CAL code by
-    adding locking and truncating expected exceptions.   Also simplify 'NOT FOUND n/a' to
-    'N/A'.  Re-interpret empty reference_file_types as "no types" instead of core
-    library default of "all types."
+    adding caching and locking.   CRDS exceptions propagate unchanged.   Also
+    simplify 'NOT FOUND n/a' to 'N/A'.  Re-interpret empty reference_file_types
+    as "no types" instead of core library default of "all types."
     """
     if not reference_file_types:   # [] interpreted as *all types*.
         return {}
-    with crds_cache_locking.get_cache_lock():
-        bestrefs = crds.getreferences(
-            data_dict, reftypes=reference_file_types, observatory=observatory)
-    refpaths = {filetype: filepath if "N/A" not in filepath.upper() else "N/A"
+    bestrefs = _cached_getreferences(
+        data_dict, reference_file_types, observatory, get_context_used(observatory))
+    refpaths = {filetype: "N/A" if _is_not_applicable(filepath) else filepath
                 for (filetype, filepath) in bestrefs.items()}
     return refpaths
 
+def _is_not_applicable(filepath):
+    """Return True IFF CRDS `filepath` is 'N/A' or 'NOT FOUND n/a'."""
+    return filepath[-3:].lower() == "n/a"
+
+# Best references per (data_items, filetype, observatory, context),  least
+# recently used first.
+_BESTREFS_CACHE = OrderedDict()
+_BESTREFS_CACHE_SIZE = 1024
+
+def _cached_getreferences(data_dict, reference_file_types, observatory, context):
+    """Memoized crds.getreferences() for a single dataset header.
+
+    Best references are remembered per reference type,  keyed on the frozen
+    items of `data_dict`,  so a lookup of many types,  e.g. Pipeline
+    prefetching,  also serves later single type lookups for the same dataset.
+    Only the types not already cached are passed to CRDS,  in one call.
+    `context` is only part of the key so that results are not reused across
+    CRDS contexts.
+    """
+    data_items = frozenset(data_dict.items())
+    bestrefs = {}
+    missing = []
+    for filetype in reference_file_types:
+        key = (data_items, filetype, observatory, context)
+        if key in _BESTREFS_CACHE:
+            _BESTREFS_CACHE.move_to_end(key)
+            bestrefs[filetype] = _BESTREFS_CACHE[key]
+        else:
+            missing.append(filetype)
+    if missing:
+        fetched = _getreferences(data_dict, tuple(missing), observatory, context)
+        for (filetype, filepath) in fetched.items():
+            _BESTREFS_CACHE[(data_items, filetype, observatory, context)] = filepath
+        while len(_BESTREFS_CACHE) > _BESTREFS_CACHE_SIZE:
+            _BESTREFS_CACHE.popitem(last=False)
+        bestrefs.update(fetched)
+    return bestrefs
+
+def _getreferences(data_dict, reference_file_types, observatory, context):
+    """Locked crds.getreferences() for `data_dict`.
+
+    The exclusive CRDS cache lock is only skipped when the cache cannot be
+    written,  i.e. when it is read-only or `context` is already cached and all
+    recommended references exist in the cache.
+    """
+    bestrefs = None
+    if _context_is_cached(context):
+        bestrefs = _get_cached_refpaths(data_dict, reference_file_types, observatory)
+    if bestrefs is None:
+        with crds_cache_locking.get_cache_lock():
+            bestrefs = crds.getreferences(
+                data_dict, reftypes=reference_file_types, observatory=observatory)
+    return bestrefs
+
+def _context_is_cached(context):
+    """Return True IFF resolving best references for `context` will not sync
+    mappings into the CRDS cache,  because the cache is read-only or all of
+    the context's mappings are already in it.
+    """
+    if config.get_cache_readonly():
+        return True
+    try:
+        crds.get_pickled_mapping(context)
+    except (exceptions.CrdsError, OSError):
+        return False
+    return True
+
+def _get_cached_refpaths(data_dict, reference_file_types, observatory):
+    """Resolve best references without locking or syncing the CRDS cache.
+
+    Returns { filetype : filepath or "NOT FOUND n/a", ... } if every
+    recommended reference already exists in the CRDS cache,  otherwise None
+    and the caller should fall back to crds.getreferences().
+    """
+    bestrefs = crds.getrecommendations(
+        data_dict, reftypes=reference_file_types, observatory=observatory)
+    refpaths = {}
+    for (filetype, filename) in bestrefs.items():
+        if _is_not_applicable(filename):
+            refpaths[filetype] = filename
+            continue
+        if filename.upper().startswith("NOT FOUND"):
+            return None   # let getreferences() report the failure
+        filepath = crds.locate_file(filename, observatory)
+        if not os.path.exists(filepath):
+            return None
+        refpaths[filetype] = filepath
+    return refpaths
+
 # ----------------------------------------------------------------------
 
 def check_reference_open(refpath):
@@ -127,10 +281,24 @@ def check_reference_open(refpath):
     Ignore reference path values of "N/A" or "" for checking.
     """
     if refpath != "N/A" and refpath.strip() != "":
-        opened = open(refpath, "rb")
-        opened.close()
+        if not (os.path.isfile(refpath) and os.access(refpath, os.R_OK)):
+            raise IOError("Reference file not readable: {0!r}".format(refpath))
     return refpath
 
+def check_references_open(refpaths):
+    """Verify that every path in `refpaths` is readable, see check_reference_open().
+
+    The checks run concurrently so that network filesystem latency,  e.g.
+    for a CRDS cache on the Central Store,  is paid once rather than per file.
+
+    Returns the list of checked reference paths.
+    """
+    refpaths = list(refpaths)
+    if not refpaths:
+        return []
+    with ThreadPoolExecutor(max_workers=min(32, len(refpaths))) as executor:
+        return list(executor.map(check_reference_open, refpaths))
+
 def get_reference_file(dataset, reference_file_type, observatory=None):
     """
     Gets a reference file from CRDS as a readable file-like object.
@@ -156,17 +324,47 @@ def get_reference_file(dataset, reference_file_type, observatory=None):
         The path of the reference in the CRDS file cache.
 
 
-    See also get_multiple_reference_paths().
+    See also get_reference_files() for fetching several types at once.
     """
     if isinstance(dataset, str):
-        from jwst import datamodels
+        from .. import datamodels
         with datamodels.open(dataset) as model:
-            return get_multiple_reference_paths(
-                model, [reference_file_type], observatory)[reference_file_type]
+            return get_reference_file(model, reference_file_type, observatory)
+    observatory, data_dict = _get_crds_parameters(dataset, observatory)
+    return _get_refpaths(
+        data_dict, (reference_file_type,), observatory)[reference_file_type]
+
+def get_reference_files(dataset, reference_file_types, observatory=None):
+    """
+    Gets several reference files from CRDS for the same dataset.
+
+    When `dataset` is a filename it is opened only once for all of
+    `reference_file_types`,  rather than once per type as repeated calls
+    to get_reference_file() would.
+
+    Parameters
+    ----------
+    dataset : jwst.datamodels.ModelBase instance or string
+        A model of the input file,  or the name of the input file.
+
+    reference_file_types : list of strings
+        The types of reference files to retrieve,  e.g. ['flat', 'dark'].
+
+    observatory: string
+        telescope name used with CRDS,  e.g. 'jwst'.
+
+    Returns
+    -------
+    reference_filepaths : dict
+        { reference_file_type : path in the CRDS file cache or "N/A", ... }
+    """
+    if isinstance(dataset, str):
+        return get_refpaths_from_filename(dataset, reference_file_types, observatory)
     else:
-        return get_multiple_reference_paths(
-            dataset, [reference_file_type], observatory)[reference_file_type]
-        
+        return get_multiple_reference_paths(dataset, reference_file_types, observatory)
+
+
+_IDENTIFIER_RE = re.compile(r'^[_A-Za-z][_A-Za-z0-9]*$')
 
 def get_override_name(reference_file_type):
     """
@@ -184,11 +382,11 @@ def get_override_name(reference_file_type):
         The configuration parameter name to use to override the given
         reference file type.
     """
-    if not re.match('^[_A-Za-z][_A-Za-z0-9]*$', reference_file_type):
+    if not _IDENTIFIER_RE.match(reference_file_type):
         raise ValueError(
             "{0!r} is not a valid reference file type name. "
             "It must be an identifier".format(reference_file_type))
-    return "override_{0}".format(reference_file_type)
+    return "override_" + reference_file_type
 
 
 def get_svn_version():
@@ -234,7 +432,24 @@ def get_context_used(observatory=None):
     observatory : string naming the telescope/project for CRDS, e.g. 'jwst'
            `observatory` should be omitted, None,  or defined as a literal string value.
            Omission and the value None are interpreted as 'jwst'.
+
+    The context is determined once per observatory and cached for the rest
+    of the process,  see reset_context_cache().
     """
     observatory = (observatory or 'jwst').lower()
+    return _get_context_used(observatory)
+
+@functools.lru_cache()
+def _get_context_used(observatory):
+    """Cached CRDS context lookup for lower case `observatory`."""
     _connected, final_context = heavy_client.get_processing_mode(observatory)
     return final_context
+
+def reset_context_cache():
+    """Discard the cached CRDS context and the best references and parameter
+    names memoized for it,  e.g. so that a changed CRDS_CONTEXT environment
+    variable takes effect.
+    """
+    _get_context_used.cache_clear()
+    _BESTREFS_CACHE.clear()
+    _CRDS_PARKEYS.clear()
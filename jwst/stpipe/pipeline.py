@@ -208,14 +208,13 @@ class Pipeline(Step):
 
         self.log.info("Prefetching reference files for dataset: " + repr(model.meta.filename) + 
                       " reftypes = " + repr(fetch_types))
-        crds_refs = crds_client.get_multiple_reference_paths(model, fetch_types)
-
-        ref_path_map = dict(list(crds_refs.items()) + list(ovr_refs.items()))
+        ref_path_map = crds_client.get_multiple_reference_paths(
+            model, self.reference_file_types, overrides=ovr_refs)
 
         for (reftype, refpath) in sorted(ref_path_map.items()):
             how = "Override" if reftype in ovr_refs else "Prefetch"
             self.log.info("{0} for {1} reference file is '{2}'.".format(how, reftype.upper(), refpath))
-            crds_client.check_reference_open(refpath)
+        crds_client.check_references_open(ref_path_map.values())
 
     @classmethod
     def _is_container(cls, input_file):
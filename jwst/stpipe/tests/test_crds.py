@@ -22,6 +22,52 @@ def setup():
 def teardown():
     shutil.rmtree(TMP_DIR)
 
+
+@pytest.fixture(autouse=True)
+def reset_crds_client_caches():
+    """Keep cached CRDS contexts and best references from leaking between tests."""
+    from .. import crds_client
+
+    crds_client.reset_context_cache()
+    yield
+    crds_client.reset_context_cache()
+
+
+@pytest.fixture
+def fake_crds_context(monkeypatch):
+    """Resolve best references with fake CRDS calls under context jwst_0001.pmap.
+
+    Recommended references are never in the cache, so lookups end in
+    crds.getreferences(), whose reftypes arguments are returned.
+    """
+    from .. import crds_client
+
+    calls = []
+
+    def fake_getreferences(data_dict, reftypes=None, observatory=None):
+        calls.append(reftypes)
+        return _fake_getrecommendations(data_dict, reftypes, observatory)
+
+    monkeypatch.setattr(crds, 'getreferences', fake_getreferences)
+    monkeypatch.setattr(crds, 'getrecommendations', _fake_getrecommendations)
+    monkeypatch.setattr(crds, 'locate_file',
+                        lambda filename, observatory: join('/nonexistent', filename))
+    monkeypatch.setattr(crds_client.heavy_client, 'get_processing_mode',
+                        lambda observatory: (False, 'jwst_0001.pmap'))
+    return calls
+
+
+class FakePipelineContext:
+    """Stand-in for a loaded CRDS .pmap."""
+
+    def get_required_parkeys(self):
+        return {
+            'nircam': ['META.INSTRUMENT.NAME', 'META.INSTRUMENT.DETECTOR',
+                       'META.INSTRUMENT.FILTER', 'META.EXPOSURE.READPATT'],
+            'miri': ['META.INSTRUMENT.NAME', 'META.INSTRUMENT.BAND'],
+        }
+
+
 class CrdsStep(Step):
     reference_file_types = ['flat']
 
@@ -131,3 +177,246 @@ def test_crds_failed_getreferences_bad_context():
         }
     with pytest.raises(crds.CrdsError):
         crds.getreferences(header, reftypes=["flat"], context="jwst_9942.pmap")
+
+def test_crds_getreferences_cached(fake_crds_context):
+    """Repeated lookups for the same header only call crds.getreferences() once."""
+    from .. import crds_client
+
+    header = {'meta.instrument.name': 'NIRCAM', 'meta.instrument.detector': 'NRCA1'}
+    for _ in range(3):
+        refpaths = crds_client._get_refpaths(header, ('flat', 'area'), 'jwst')
+    assert refpaths == {'flat': 'jwst_nircam_flat_0001.fits', 'area': 'N/A'}
+    assert fake_crds_context == [('flat', 'area')]
+
+
+def test_crds_batch_lookup_serves_single_lookups(monkeypatch, fake_crds_context):
+    """Prefetching many reftypes answers later single reftype lookups."""
+    from .. import crds_client
+
+    class FakeModel:
+        def __init__(self):
+            self._instance = {'meta': {
+                'filename': 'crds.fits',
+                'instrument': {'name': 'NIRCAM', 'detector': 'NRCA1'},
+                'exposure': {'readpatt': 'RAPID'},
+            }}
+
+    monkeypatch.setattr(crds, 'get_pickled_mapping',
+                        lambda context: FakePipelineContext())
+
+    refpaths = crds_client.get_multiple_reference_paths(
+        FakeModel(), ['flat', 'dark'], observatory='jwst')
+    assert refpaths == {'flat': 'jwst_nircam_flat_0001.fits',
+                        'dark': 'jwst_nircam_dark_0001.fits'}
+    assert crds_client.get_reference_file(FakeModel(), 'flat', 'jwst') == \
+        'jwst_nircam_flat_0001.fits'
+    assert crds_client.get_reference_file(FakeModel(), 'dark', 'jwst') == \
+        'jwst_nircam_dark_0001.fits'
+    assert fake_crds_context == [('flat', 'dark')]
+
+
+def test_crds_getreferences_unlocked_when_cached(monkeypatch, tmp_path, fake_crds_context):
+    """References already in the CRDS cache are resolved without locking."""
+    from .. import crds_client
+
+    def fail(*args, **kwargs):
+        raise AssertionError('CRDS cache should not be locked or synced')
+
+    (tmp_path / 'jwst_nircam_flat_0001.fits').touch()
+    monkeypatch.setattr(crds, 'getreferences', fail)
+    monkeypatch.setattr(crds_client.crds_cache_locking, 'get_cache_lock', fail)
+    monkeypatch.setattr(crds, 'locate_file',
+                        lambda filename, observatory: str(tmp_path / filename))
+
+    refpaths = crds_client._get_cached_refpaths({}, ('flat', 'area'), 'jwst')
+    assert refpaths == {'flat': str(tmp_path / 'jwst_nircam_flat_0001.fits'),
+                        'area': 'NOT FOUND n/a'}
+
+
+def test_crds_getreferences_locked_for_uncached_context(monkeypatch, fake_crds_context):
+    """A context not yet in the CRDS cache is synced under the cache lock."""
+    from .. import crds_client
+
+    def fail(*args, **kwargs):
+        raise AssertionError('mappings should not be synced without the lock')
+
+    def not_cached(context):
+        raise crds.CrdsError('mapping not in cache')
+
+    locks = []
+
+    class FakeLock:
+        def __enter__(self):
+            locks.append(self)
+
+        def __exit__(self, *args):
+            pass
+
+    monkeypatch.setattr(crds, 'getrecommendations', fail)
+    monkeypatch.setattr(crds, 'get_pickled_mapping', not_cached)
+    monkeypatch.setattr(crds_client.config, 'get_cache_readonly', lambda: False)
+    monkeypatch.setattr(crds_client.crds_cache_locking, 'get_cache_lock', FakeLock)
+
+    refpaths = crds_client._get_refpaths({}, ('flat',), 'jwst')
+    assert refpaths == {'flat': 'jwst_nircam_flat_0001.fits'}
+    assert len(locks) == 1
+
+
+def _fake_getrecommendations(data_dict, reftypes=None, observatory=None):
+    return {reftype: ('NOT FOUND n/a' if reftype == 'area'
+                      else 'jwst_nircam_{}_0001.fits'.format(reftype))
+            for reftype in reftypes}
+
+def test_check_reference_open(tmp_path):
+    """Readable and N/A references pass, missing references raise."""
+    from .. import crds_client
+
+    refpath = tmp_path / 'jwst_nircam_flat_0001.fits'
+    refpath.touch()
+    assert crds_client.check_reference_open(str(refpath)) == str(refpath)
+    assert crds_client.check_reference_open('N/A') == 'N/A'
+    assert crds_client.check_reference_open('') == ''
+    with pytest.raises(IOError):
+        crds_client.check_reference_open(str(tmp_path / 'missing.fits'))
+    with pytest.raises(IOError):
+        crds_client.check_reference_open(str(tmp_path))
+
+def test_check_references_open(tmp_path):
+    """Batch readability check returns the paths and raises on any failure."""
+    from .. import crds_client
+
+    refpaths = [str(tmp_path / 'ref{}.fits'.format(idx)) for idx in range(5)]
+    for refpath in refpaths:
+        open(refpath, 'w').close()
+    assert crds_client.check_references_open(refpaths + ['N/A']) == refpaths + ['N/A']
+    assert crds_client.check_references_open([]) == []
+    with pytest.raises(IOError):
+        crds_client.check_references_open(refpaths + [str(tmp_path / 'missing.fits')])
+
+
+def test_get_context_used_cached(monkeypatch):
+    """The CRDS context is looked up once until the cache is reset."""
+    from .. import crds_client
+
+    contexts = iter(['jwst_0001.pmap', 'jwst_0002.pmap'])
+    monkeypatch.setattr(crds_client.heavy_client, 'get_processing_mode',
+                        lambda observatory: (False, next(contexts)))
+
+    assert crds_client.get_context_used() == 'jwst_0001.pmap'
+    assert crds_client.get_context_used('JWST') == 'jwst_0001.pmap'
+    crds_client.reset_context_cache()
+    assert crds_client.get_context_used('jwst') == 'jwst_0002.pmap'
+
+def test_get_multiple_reference_paths_all_overridden():
+    """Fully overridden requests never read the dataset header or CRDS."""
+    from .. import crds_client
+
+    class NoHeaderModel:
+        def to_flat_dict(self, include_arrays=True):
+            raise AssertionError('dataset header should not be read')
+
+    overrides = {'flat': '/refs/flat.fits', 'dark': '/refs/dark.fits'}
+    refpaths = crds_client.get_multiple_reference_paths(
+        NoHeaderModel(), ['flat', 'dark'], overrides=overrides)
+    assert refpaths == overrides
+
+def test_crds_parkeys_for(monkeypatch):
+    """The parameters of every instrument are collected."""
+    from .. import crds_client
+
+    monkeypatch.setattr(crds, 'get_pickled_mapping',
+                        lambda context: FakePipelineContext())
+
+    parkeys = crds_client._crds_parkeys_for('jwst_0001.pmap')
+    assert parkeys == ('meta.exposure.readpatt', 'meta.instrument.band',
+                       'meta.instrument.detector', 'meta.instrument.filter',
+                       'meta.instrument.name')
+
+
+def test_crds_parkeys_for_uncached_context(monkeypatch):
+    """A context missing from the CRDS cache is retried on the next lookup."""
+    from .. import crds_client
+
+    def not_cached(context):
+        raise crds.CrdsError('mapping not in cache')
+
+    monkeypatch.setattr(crds, 'get_pickled_mapping', not_cached)
+    assert crds_client._crds_parkeys_for('jwst_0001.pmap') is None
+
+    monkeypatch.setattr(crds, 'get_pickled_mapping',
+                        lambda context: FakePipelineContext())
+    assert crds_client._crds_parkeys_for('jwst_0001.pmap') == (
+        'meta.exposure.readpatt', 'meta.instrument.band',
+        'meta.instrument.detector', 'meta.instrument.filter',
+        'meta.instrument.name')
+
+
+def test_get_data_dict_parkeys():
+    """Only the requested keywords are read and the model is not modified."""
+    from ... import datamodels
+    from .. import crds_client
+
+    with datamodels.ImageModel(join(dirname(__file__), 'data/crds.fits')) as model:
+        before = model.to_flat_dict(include_arrays=False)
+        data_dict = crds_client._get_data_dict(
+            model, ('meta.instrument.name', 'meta.instrument.detector',
+                    'meta.exposure.readpatt', 'meta.subarray.fastaxis'))
+        assert data_dict == {
+            key: before[key]
+            for key in ('meta.instrument.name', 'meta.instrument.detector',
+                        'meta.exposure.readpatt', 'meta.subarray.fastaxis')
+            if key in before
+        }
+        assert data_dict['meta.instrument.name'] == 'NIRCAM'
+        assert model.to_flat_dict(include_arrays=False) == before
+
+def _fake_get_multiple_reference_paths(calls):
+    def get_multiple_reference_paths(dataset_model, reference_file_types,
+                                     observatory=None):
+        calls.append((dataset_model, list(reference_file_types)))
+        return {reftype: reftype + '.fits' for reftype in reference_file_types}
+    return get_multiple_reference_paths
+
+
+def test_get_reference_files_model(monkeypatch):
+    """Open models are passed through for all reftypes in one lookup."""
+    from .. import crds_client
+
+    calls = []
+    monkeypatch.setattr(crds_client, 'get_multiple_reference_paths',
+                        _fake_get_multiple_reference_paths(calls))
+
+    model = object()
+    refpaths = crds_client.get_reference_files(model, ['flat', 'dark'])
+    assert refpaths == {'flat': 'flat.fits', 'dark': 'dark.fits'}
+    assert calls == [(model, ['flat', 'dark'])]
+
+
+def test_get_reference_files_filename(monkeypatch):
+    """A filename is opened once for all reftypes."""
+    from ... import datamodels
+    from .. import crds_client
+
+    class FakeModel:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            self.closed = True
+
+    opened = []
+
+    def fake_open(filename):
+        opened.append(FakeModel())
+        return opened[-1]
+
+    calls = []
+    monkeypatch.setattr(datamodels, 'open', fake_open)
+    monkeypatch.setattr(crds_client, 'get_multiple_reference_paths',
+                        _fake_get_multiple_reference_paths(calls))
+
+    refpaths = crds_client.get_reference_files('crds.fits', ['flat', 'dark', 'area'])
+    assert refpaths == {'flat': 'flat.fits', 'dark': 'dark.fits', 'area': 'area.fits'}
+    assert len(opened) == 1
+    assert opened[0].closed
+    assert calls == [(opened[0], ['flat', 'dark', 'area'])]
@@ -46,6 +46,10 @@ class BaseJWSTTest:
 
     @pytest.fixture(autouse=True)
     def auto_toggle_docopy(self):
+        self.toggle_docopy()
+
+    def toggle_docopy(self):
+        """Copy data files only when the bigdata root is a URL"""
         bigdata_root = get_bigdata_root()
         if bigdata_root and check_url(bigdata_root):
             self.docopy = True
@@ -1,6 +1,7 @@
 """Test using SDP-generated pools
 """
-from collections import Counter
+from collections import defaultdict
+from functools import lru_cache
 from pathlib import Path
 import pytest
 import re
@@ -11,84 +12,161 @@ from jwst.associations.lib.diff import (
 from jwst.tests.base_classes import BaseJWSTTest
 
 from jwst.associations.main import Main as asn_generate
+from jwst.lib.file_utils import pushdir
 
 # Main test args
 TEST_ARGS = ['--dry-run', '--no-merge']
 
-# Decompose pool name to retrieve proposal and version id.
-pool_regex = re.compile(r'(?P<proposal>jw.+?)_(?P<versionid>.+)_pool')
+# Decompose truth association name to retrieve proposal and version id.
+truth_regex = re.compile(
+    r'(?:.*/)?(?P<proposal>jw[^/]+?)[-_][^/]*?_(?P<versionid>[^_/]+)_[^_/]+_[^_/]+_asn\.json$',
+    flags=re.IGNORECASE
+)
 
 
 # #############################################################
 # Setup a base class and instantiate it in order to provide the
-# file lists for the test parametrization.
+# file lists for the test parametrization at collection time.
 # #############################################################
 class AssociationBase(BaseJWSTTest):
     input_loc = 'associations'
     test_dir = 'sdp'
     ref_loc = [test_dir, 'truth']
 
-    _pool_paths = None
-    _truth_paths = None
+    # Glob results shared by all instances, keyed by repo path, path and glob.
+    _data_glob_cache = {}
+
+    _truth_index = None
 
     @property
     def pool_paths(self):
-        if self._pool_paths is None:
-            self._pool_paths = self.data_glob(self.test_dir, 'pools', glob='*.csv')
-        return self._pool_paths
+        return self.data_glob(self.test_dir, 'pools', glob='*.csv')
 
     @property
     def truth_paths(self):
-        if self._truth_paths is None:
-            self._truth_paths = self.data_glob(*self.ref_loc, glob='*.json')
-        return self._truth_paths
+        return self.data_glob(*self.ref_loc, glob='*.json')
+
+    @property
+    def truth_index(self):
+        """Truth paths keyed by lower case (proposal, version id)"""
+        if self._truth_index is None:
+            truth_index = defaultdict(list)
+            for truth_path in self.truth_paths:
+                match = truth_regex.match(truth_path)
+                if match:
+                    key = tuple(
+                        part.lower()
+                        for part in match.group('proposal', 'versionid')
+                    )
+                    truth_index[key].append(truth_path)
+            self._truth_index = dict(truth_index)
+        return self._truth_index
+
+    def data_glob(self, *pathargs, glob='*'):
+        """Retrieve file list matching glob, only searching once per path
+
+        Returns
+        -------
+        file_paths: (str[, ...])
+            Tuple of file paths, see `BaseJWSTTest.data_glob`
+        """
+        key = (tuple(self.repo_path), pathargs, glob)
+        try:
+            file_paths = self._data_glob_cache[key]
+        except KeyError:
+            file_paths = tuple(super().data_glob(*pathargs, glob=glob))
+            self._data_glob_cache[key] = file_paths
+        return file_paths
 
 asn_base = AssociationBase()
-try:
-    POOL_PATHS = asn_base.pool_paths
-except Exception:
-    POOL_PATHS = ['test will be skipped']
+
+
+@lru_cache()
+def _pool_records():
+    """Pool records for parametrization, only globbed once tests are collected
+
+    Returns
+    -------
+    records: ((pool_path, pool, proposal, version_id, pool_token)[, ...])
+    """
+    try:
+        pool_paths = asn_base.pool_paths
+    except Exception:
+        pool_paths = ['test will be skipped']
+    return tuple(_pool_record(pool_path) for pool_path in pool_paths)
+
+
+def _pool_record(pool_path):
+    """Decompose pool name, `jw<proposal>_<version id>_pool`
+
+    Returns
+    -------
+    pool_path, pool, proposal, version_id, pool_token
+        Missing name components are None; `pool_token` is
+        checked by the tests so a bad name only fails that pool.
+    """
+    pool = Path(pool_path).stem
+    proposal, version_id, pool_token = ([None, None] + pool.rsplit('_', 2))[-3:]
+    return pool_path, pool, proposal, version_id, pool_token
+
+
+def pytest_generate_tests(metafunc):
+    """Parametrize over the pools when a test requires them"""
+    if 'pool_record' in metafunc.fixturenames:
+        records = _pool_records()
+        metafunc.parametrize(
+            'pool_record',
+            records,
+            ids=[record[1] for record in records],
+            scope='class'
+        )
 
 
 # #####
 # Tests
 # #####
 class TestSDPPools(AssociationBase):
-    @pytest.mark.parametrize(
-        'pool_path',
-        POOL_PATHS
-    )
-    def test_against_standard(self, pool_path):
-        """Compare a generated association against a standard
+    @pytest.fixture(scope='class')
+    def generated_asns(self, pool_record, tmp_path_factory):
+        """Generate the associations for a pool once for all tests
 
-        Success is when no other AssertionError occurs.
+        Returns
+        -------
+        proposal, version_id, generated_path, associations
         """
+        pool_path, pool, proposal, version_id, pool_token = pool_record
+        assert pool_token == 'pool', 'Unexpected pool name {}'.format(pool_path)
 
-        # Parse pool name
-        pool = Path(pool_path).stem
-        proposal, version_id = pool_regex.match(pool).group('proposal', 'versionid')
+        # The function-scoped `auto_toggle_docopy` has not run at class scope.
+        self.toggle_docopy()
 
-        # Create the associations
-        generated_path = Path('generate')
+        # Create the associations. Class-scoped fixtures run outside of the
+        # tests' `_jail`, so download and generate in a per-pool directory.
+        pool_dir = tmp_path_factory.mktemp(pool)
+        generated_path = pool_dir / 'generate'
         generated_path.mkdir()
-        asn_generate([
-            '--no-merge',
-            '-p', str(generated_path),
-            '--version-id', version_id,
-            self.get_data(pool_path)
-        ])
+        with pushdir(pool_dir):
+            results = asn_generate([
+                '--no-merge',
+                '-p', str(generated_path),
+                '--version-id', version_id,
+                self.get_data(pool_path)
+            ])
+        return proposal, version_id, generated_path, results.associations
+
+    def test_against_standard(self, generated_asns):
+        """Compare a generated association against a standard
+
+        Success is when no other AssertionError occurs.
+        """
+        proposal, version_id, generated_path, _ = generated_asns
 
         # Retrieve the truth files
-        asn_regex = re.compile(
-            r'.+{proposal}.+{version_id}(_[^_]+?_[^_]+?_asn\.json)$'.format(
-                proposal=proposal, version_id=version_id
-            ),
-            flags=re.IGNORECASE
-        )
         truth_paths = [
             self.get_data(truth_path)
-            for truth_path in asn_base.truth_paths
-            if asn_regex.match(truth_path)
+            for truth_path in asn_base.truth_index.get(
+                (proposal.lower(), version_id.lower()), []
+            )
         ]
 
         # Compare the association sets.
@@ -100,30 +178,18 @@ class TestSDPPools(AssociationBase):
             else:
                 raise
 
-    @pytest.mark.parametrize(
-        'pool_path',
-        POOL_PATHS
-    )
-    def test_dup_product_names(self, pool_path):
+    def test_dup_product_names(self, generated_asns):
         """Check for duplicate product names for a pool"""
-
-        results = asn_generate([
-            '--dry-run',
-            '--no-merge',
-            self.get_data(pool_path)
-        ])
-        asns = results.associations
-
-        product_names = Counter(
-            product['name']
-            for asn in asns
-            for product in asn['products']
-        )
-
-        multiples = [
-            product_name
-            for product_name, count in product_names.items()
-            if count > 1
-        ]
-
-        assert not len(multiples), 'Multiple product names: {}'.format(multiples)
+        _, _, _, asns = generated_asns
+
+        product_names = set()
+        multiples = []
+        for asn in asns:
+            for product in asn['products']:
+                product_name = product['name']
+                if product_name in product_names:
+                    multiples.append(product_name)
+                else:
+                    product_names.add(product_name)
+
+        assert not multiples, 'Multiple product names: {}'.format(multiples)